@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 """Bildet die App Sektion von piCtory ab."""
+from copy import deepcopy
 from time import strptime
 
 __author__ = "Sven Sager"
@@ -38,4 +39,4 @@ class App(object):
                 self.savets = None
 
         # TODO: Layout untersuchen und anders abbilden
-        self.layout = app["layout"]
+        self.layout = deepcopy(app["layout"])
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 """Modul fuer die Verwaltung der Devices."""
+from copy import deepcopy
 from threading import Event, Lock, Thread
 
 from .helper import ProcimgWriter
@@ -26,7 +27,7 @@ class DeviceList(object):
         if type(key) == int:
             return key in self.__dict_position
         elif type(key) == str:
-            return hasattr(self, key)
+            return key in self.__dict__
         else:
             return key in self.__dict_position.values()
 
@@ -77,6 +78,8 @@ class DeviceList(object):
             if key not in self.__dict_position:
                 raise IndexError("no device on position {0}".format(key))
             return self.__dict_position[key]
+        elif key in self.__dict__:
+            return self.__dict__[key]
         else:
             return getattr(self, key)
 
@@ -125,11 +128,12 @@ class Device(object):
     """
 
     __slots__ = "__my_io_list", "_ba_devdata", "_ba_datacp", \
-                "_dict_events", "_filelock", "_length", "_modio", "_name", "_offset", \
+                "_dict_events", "_ev_table", "_filelock", "_length", \
+                "_modio", "_name", "_offset", \
                 "_position", "_producttype", "_selfupdate", "_slc_devoff", \
                 "_slc_inp", "_slc_inpoff", "_slc_mem", "_slc_memoff", \
-                "_slc_out", "_slc_outoff", "bmk", "catalognr", "comment", "extend", \
-                "guid", "id", "inpvariant", "outvariant", "type"
+                "_slc_out", "_slc_outoff", "bmk", "catalognr", "comment", \
+                "extend", "guid", "id", "inpvariant", "outvariant", "type"
 
     def __init__(self, parentmodio, dict_device, simulator=False):
         """
@@ -142,6 +146,7 @@ class Device(object):
         self._modio = parentmodio
 
         self._dict_events = {}
+        self._ev_table = ((), (), (), (), (), {})
         self._filelock = Lock()
         self._length = 0
         self.__my_io_list = []
@@ -185,13 +190,13 @@ class Device(object):
 
         # Neues bytearray und Kopie für mainloop anlegen
         self._ba_devdata = bytearray(self._length)
-        self._ba_datacp = bytearray()
+        self._ba_datacp = bytearray(self._length)
 
         # Alle restlichen attribute an Klasse anhängen
         self.bmk = dict_device.get("bmk", "")
         self.catalognr = dict_device.get("catalogNr", "")
         self.comment = dict_device.get("comment", "")
-        self.extend = dict_device.get("extend", {})
+        self.extend = deepcopy(dict_device.get("extend", {}))
         self.guid = dict_device.get("GUID", "")
         self.id = dict_device.get("id", "")
         self.inpvariant = dict_device.get("inpVariant", 0)
@@ -375,6 +380,41 @@ class Device(object):
         """
         return self._producttype
 
+    def _update_event_table(self) -> None:
+        """
+        Erzeugt die Eventtabelle fuer die Eventueberwachung.
+
+        Die registrierten Events werden in parallele Tupel (IO-Objekte,
+        Bitmasken ueber die Devicedaten, Byteadressen, Bitshifts,
+        Eventfunktionen) aufgeteilt, damit der ProcimgWriter diese ohne dict-
+        und Attributzugriffe durchlaufen kann. Dazu kommt ein <class 'dict'>,
+        welches jedem 8-Byte Wort der Devicedaten die Indizes der Events
+        zuordnet, die dieses Wort beruehren. Muss bei jeder Aenderung von
+        _dict_events aufgerufen werden.
+        """
+        tup_io = tuple(self._dict_events)
+        lst_diffmask = []
+        dict_word = {}
+        for index, io in enumerate(tup_io):
+            start = io._slc_address.start
+            stop = io._slc_address.stop
+            if io._bitshift:
+                lst_diffmask.append(io._bitshift << start * 8)
+            else:
+                lst_diffmask.append((1 << (stop - start) * 8) - 1 << start * 8)
+
+            for word in range(start // 8, (stop - 1) // 8 + 1):
+                dict_word.setdefault(word, []).append(index)
+
+        self._ev_table = (
+            tup_io,
+            tuple(lst_diffmask),
+            tuple(io._slc_address.start for io in tup_io),
+            tuple(io._bitshift or 0 for io in tup_io),
+            tuple(tuple(self._dict_events[io]) for io in tup_io),
+            {word: tuple(dict_word[word]) for word in dict_word},
+        )
+
     def _update_my_io_list(self) -> None:
         """Erzeugt eine neue IO Liste fuer schnellen Zugriff."""
         self.__my_io_list = list(self.__iter__())
@@ -392,13 +432,14 @@ class Device(object):
 
             # Datenkopie anlegen
             with self._filelock:
-                self._ba_datacp = self._ba_devdata[:]
+                self._ba_datacp[:] = self._ba_devdata
 
             self._selfupdate = True
 
             # Sicher in Liste einfügen
             with self._modio._imgwriter.lck_refresh:
                 self._modio._lst_refresh.append(self)
+                self._modio._refresh_gen += 1
 
             # Thread starten, wenn er noch nicht läuft
             if not self._modio._imgwriter.is_alive():
@@ -414,6 +455,7 @@ class Device(object):
             # Sicher aus Liste entfernen
             with self._modio._imgwriter.lck_refresh:
                 self._modio._lst_refresh.remove(self)
+                self._modio._refresh_gen += 1
             self._selfupdate = False
 
             # Beenden, wenn keien Devices mehr in Liste sind
@@ -2,10 +2,27 @@
 """RevPiModIO Helperklassen und Tools."""
 import queue
 import warnings
+from heapq import heappop, heappush
+from itertools import count
 from math import ceil
+from os import close
 from threading import Event, Lock, Thread
 from timeit import default_timer
 
+try:
+    # Erst ab Python 3.7 verfügbar
+    from os import preadv, pwrite
+except ImportError:
+    preadv = None
+    pwrite = None
+try:
+    # Erst ab Python 3.10 unter Linux verfügbar, poll fehlt unter Windows
+    from os import EFD_CLOEXEC, EFD_NONBLOCK, eventfd, eventfd_read, \
+        eventfd_write
+    from select import POLLIN, poll
+except ImportError:
+    eventfd = None
+
 from revpimodio2 import BOTH, FALLING, RISING
 from revpimodio2.io import IOBase
 
@@ -14,6 +31,90 @@ __copyright__ = "Copyright (C) 2020 Sven Sager"
 __license__ = "LGPLv3"
 
 
+def _scan_events(ba_datacp, ba_devdata, tup_diffmask, dict_word) -> list:
+    """
+    Ermittelt die Indizes der Events, deren IO sich geaendert hat.
+
+    Reine Vergleichsfunktion ohne Zugriff auf IO-Objekte, damit die
+    Auswertung der Events getrennt davon erfolgen kann.
+
+    :param ba_datacp: Kopie der Devicedaten vom letzten Zyklus
+    :param ba_devdata: Aktuelle Devicedaten
+    :param tup_diffmask: Bitmaske je Event ueber die Devicedaten
+    :param dict_word: Event-Indizes je 8-Byte Wort der Devicedaten
+    :return: Sortierte <class 'list'> der ausgeloesten Event-Indizes
+    """
+    # Alle geänderten Bits des Devices in einem <class 'int'> sammeln
+    int_diff = int.from_bytes(ba_datacp, byteorder="little") \
+        ^ int.from_bytes(ba_devdata, byteorder="little")
+
+    # Nur Events in geänderten 8-Byte Worten prüfen
+    set_index = set()
+    int_word = 0
+    int_scan = int_diff
+    while int_scan:
+        if int_scan & 0xFFFFFFFFFFFFFFFF and int_word in dict_word:
+            set_index.update(dict_word[int_word])
+        int_scan >>= 64
+        int_word += 1
+
+    return [
+        index for index in sorted(set_index)
+        if int_diff & tup_diffmask[index]
+    ]
+
+
+class EventFd:
+    """
+    Ersatz fuer <class 'threading.Event'> auf Basis eines Linux eventfd.
+
+    Das Setzen und Warten erfolgt direkt ueber Systemaufrufe auf dem
+    Dateideskriptor, ohne Condition und Lock von threading.Event.
+    """
+
+    __slots__ = "_fd"
+
+    def __init__(self):
+        """Init EventFd class."""
+        self._fd = eventfd(0, EFD_NONBLOCK | EFD_CLOEXEC)
+
+    def __del__(self):
+        """Schliesst den Dateideskriptor."""
+        if hasattr(self, "_fd"):
+            close(self._fd)
+
+    def clear(self) -> None:
+        """Setzt das Event zurueck."""
+        try:
+            eventfd_read(self._fd)
+        except BlockingIOError:
+            pass
+
+    def is_set(self) -> bool:
+        """
+        Prueft ob das Event gesetzt ist.
+
+        :return: True, wenn gesetzt
+        """
+        return self.wait(0)
+
+    def set(self) -> None:
+        """Setzt das Event und weckt alle Wartenden auf."""
+        eventfd_write(self._fd, 1)
+
+    def wait(self, timeout=None) -> bool:
+        """
+        Wartet bis das Event gesetzt wird.
+
+        :param timeout: Maximale Wartezeit in Sekunden, None wartet endlos
+        :return: True, wenn Event gesetzt wurde
+        """
+        # Eigenes poll-Objekt, da Wartende in mehreren Threads moeglich sind
+        p = poll()
+        p.register(self._fd, POLLIN)
+        return len(p.poll(None if timeout is None else timeout * 1000)) > 0
+
+
 class EventCallback(Thread):
     """Thread fuer das interne Aufrufen von Event-Funktionen.
 
@@ -362,14 +463,18 @@ class ProcimgWriter(Thread):
     Event-Handling verwendet.
     """
 
-    __slots__ = "__dict_delay", "__eventth", "_eventqth", "__eventwork", \
+    __slots__ = "__delay_heap", "__delay_pending", "__delay_seq", \
+                "__delay_tick", "__eventth", "_eventqth", "__eventwork", \
                 "_adjwait", "_eventq", "_modio", \
                 "_refresh", "_work", "daemon", "lck_refresh", "newdata"
 
     def __init__(self, parentmodio):
         """Init ProcimgWriter class."""
         super().__init__()
-        self.__dict_delay = {}
+        self.__delay_heap = []
+        self.__delay_pending = {}
+        self.__delay_seq = count()
+        self.__delay_tick = 0
         self.__eventth = Thread(target=self.__exec_th)
         self._eventqth = queue.Queue()
         self.__eventwork = False
@@ -381,78 +486,68 @@ class ProcimgWriter(Thread):
 
         self.daemon = True
         self.lck_refresh = Lock()
-        self.newdata = Event()
+        self.newdata = Event() if eventfd is None else EventFd()
 
     def __check_change(self, dev) -> None:
         """Findet Aenderungen fuer die Eventueberwachung."""
-        for io_event in dev._dict_events:
-
-            if dev._ba_datacp[io_event._slc_address] == \
-                    dev._ba_devdata[io_event._slc_address]:
-                continue
-
-            if io_event._bitshift:
-                boolcp = dev._ba_datacp[io_event._slc_address.start] \
-                    & io_event._bitshift
-                boolor = dev._ba_devdata[io_event._slc_address.start] \
-                    & io_event._bitshift
-
-                if boolor == boolcp:
-                    continue
-
-                for regfunc in dev._dict_events[io_event]:
-                    if regfunc.edge == BOTH \
-                            or regfunc.edge == RISING and boolor \
-                            or regfunc.edge == FALLING and not boolor:
-                        if regfunc.delay == 0:
-                            if regfunc.as_thread:
-                                self._eventqth.put(
-                                    (regfunc, io_event._name, io_event.value),
-                                    False
-                                )
-                            else:
-                                self._eventq.put(
-                                    (regfunc, io_event._name, io_event.value),
-                                    False
-                                )
-                        else:
-                            # Verzögertes Event in dict einfügen
-                            tup_fire = (
-                                regfunc, io_event._name, io_event.value,
-                                io_event,
-                            )
-                            if regfunc.overwrite \
-                                    or tup_fire not in self.__dict_delay:
-                                self.__dict_delay[tup_fire] = ceil(
-                                    regfunc.delay / 1000 / self._refresh
-                                )
+        # Für die Schleife lokal binden
+        ba_datacp = dev._ba_datacp
+        ba_devdata = dev._ba_devdata
+        delay_heap = self.__delay_heap
+        delay_pending = self.__delay_pending
+        delay_tick = self.__delay_tick
+        refresh = self._refresh
+        eventq_put = self._eventq.put
+        eventqth_put = self._eventqth.put
+        tup_io, tup_diffmask, tup_byteindex, tup_bitshift, tup_regfuncs, \
+            dict_word = dev._ev_table
+
+        for index in _scan_events(
+                ba_datacp, ba_devdata, tup_diffmask, dict_word):
+            io_event = tup_io[index]
+            bitshift = tup_bitshift[index]
+            if bitshift:
+                int_edge = 2 if ba_devdata[tup_byteindex[index]] & bitshift \
+                    else 1
             else:
-                for regfunc in dev._dict_events[io_event]:
+                # Byte IOs haben immer edge BOTH
+                int_edge = 3
+
+            value = io_event.value
+            for regfunc in tup_regfuncs[index]:
+                if regfunc._edgemask & int_edge:
                     if regfunc.delay == 0:
                         if regfunc.as_thread:
-                            self._eventqth.put(
-                                (regfunc, io_event._name, io_event.value),
-                                False
+                            eventqth_put(
+                                (regfunc, io_event._name, value), False
                             )
                         else:
-                            self._eventq.put(
-                                (regfunc, io_event._name, io_event.value),
-                                False
+                            eventq_put(
+                                (regfunc, io_event._name, value), False
                             )
                     else:
-                        # Verzögertes Event in dict einfügen
-                        tup_fire = (
-                            regfunc, io_event._name, io_event.value,
-                            io_event,
-                        )
+                        # Verzögertes Event mit Ausführungszyklus einreihen
+                        tup_fire = (regfunc, io_event._name, value, io_event)
                         if regfunc.overwrite \
-                                or tup_fire not in self.__dict_delay:
-                            self.__dict_delay[tup_fire] = ceil(
-                                regfunc.delay / 1000 / self._refresh
-                            )
+                                or tup_fire not in delay_pending:
+                            # Rohdaten für Prüfung bei overwrite merken
+                            if bitshift:
+                                snapshot = \
+                                    ba_devdata[tup_byteindex[index]] & bitshift
+                            else:
+                                snapshot = \
+                                    bytes(ba_devdata[io_event._slc_address])
+
+                            seq = next(self.__delay_seq)
+                            delay_pending[tup_fire] = seq
+                            heappush(delay_heap, (
+                                delay_tick
+                                + ceil(regfunc.delay / 1000 / refresh),
+                                seq, tup_fire, snapshot
+                            ))
 
         # Nach Verarbeitung aller IOs die Bytes kopieren (Lock ist noch drauf)
-        dev._ba_datacp = dev._ba_devdata[:]
+        dev._ba_datacp[:] = dev._ba_devdata
 
     def __exec_th(self) -> None:
         """Laeuft als Thread, der Events als Thread startet."""
@@ -488,7 +583,8 @@ class ProcimgWriter(Thread):
                     # Nur leeren beim deaktivieren
                     self._eventqth = queue.Queue()
                     self._eventq = queue.Queue()
-                    self.__dict_delay = {}
+                    self.__delay_heap = []
+                    self.__delay_pending = {}
 
             # Threadmanagement
             if value and not self.__eventth.is_alive():
@@ -508,18 +604,43 @@ class ProcimgWriter(Thread):
 
     def run(self):
         """Startet die automatische Prozessabbildsynchronisierung."""
-        fh = self._modio._create_myfh()
+        modio = self._modio
+        mm = modio._mm
+        fd = None
+        if mm is None:
+            fh = modio._create_myfh()
+            bytesbuff = memoryview(bytearray(modio._length))
+            if modio._fd is not None:
+                # Direkter Zugriff über den Dateideskriptor ohne seek()
+                fd = fh.fileno()
+        else:
+            # Gemapptes Prozessabbild direkt als Puffer verwenden
+            fh = None
+            bytesbuff = mm
         self._adjwait = self._refresh
 
+        # Für die Schleife lokal binden
+        lck_acquire = self.lck_refresh.acquire
+        lck_release = self.lck_refresh.release
+        newdata_set = self.newdata.set
+        work_is_set = self._work.is_set
+        work_wait = self._work.wait
+        timer = default_timer
+        all_devdata = modio._monitoring or modio._direct_output
+        buffedwrite = modio._buffedwrite
+
+        # Devices als tuple, nur bei Änderung der Liste neu erstellen
+        tup_refresh = tuple(modio._lst_refresh)
+        refresh_gen = modio._refresh_gen
+
         mrk_warn = True
-        mrk_dt = default_timer()
+        mrk_dt = timer()
 
-        bytesbuff = bytearray(self._modio._length)
-        while not self._work.is_set():
+        while not work_is_set():
             ot = mrk_dt
 
             # Lockobjekt holen und Fehler werfen, wenn nicht schnell genug
-            if not self.lck_refresh.acquire(timeout=self._adjwait):
+            if not lck_acquire(timeout=self._adjwait):
                 warnings.warn(
                     "cycle time of {0} ms exceeded during executing function"
                     "".format(int(self._refresh * 1000)),
@@ -529,45 +650,73 @@ class ProcimgWriter(Thread):
                 continue
 
             try:
-                fh.seek(0)
-                fh.readinto(bytesbuff)
-
-                if self._modio._monitoring or self._modio._direct_output:
+                if refresh_gen != modio._refresh_gen:
+                    tup_refresh = tuple(modio._lst_refresh)
+                    refresh_gen = modio._refresh_gen
+
+                if fd is not None:
+                    preadv(fd, [bytesbuff], 0)
+                elif fh is not None:
+                    fh.seek(0)
+                    fh.readinto(bytesbuff)
+
+                # Das Kopieren der Bereiche erfolgt als atomare Zuweisung ohne
+                # _filelock, nur die Eventauswertung sperrt das Device
+                if all_devdata:
                     # Inputs und Outputs in Puffer
-                    for dev in self._modio._lst_refresh:
-                        with dev._filelock:
-                            dev._ba_devdata[:] = bytesbuff[dev._slc_devoff]
-                            if self.__eventwork \
-                                    and len(dev._dict_events) > 0 \
-                                    and dev._ba_datacp != dev._ba_devdata:
+                    for dev in tup_refresh:
+                        dev._ba_devdata[:] = bytesbuff[dev._slc_devoff]
+                        if self.__eventwork \
+                                and len(dev._dict_events) > 0 \
+                                and dev._ba_datacp != dev._ba_devdata:
+                            with dev._filelock:
                                 self.__check_change(dev)
 
                 else:
                     # Inputs in Puffer, Outputs in Prozessabbild
-                    for dev in self._modio._lst_refresh:
-                        with dev._filelock:
-                            dev._ba_devdata[dev._slc_inp] = \
-                                bytesbuff[dev._slc_inpoff]
-                            if self.__eventwork \
-                                    and len(dev._dict_events) > 0 \
-                                    and dev._ba_datacp != dev._ba_devdata:
+                    for dev in tup_refresh:
+                        dev._ba_devdata[dev._slc_inp] = \
+                            bytesbuff[dev._slc_inpoff]
+                        if self.__eventwork \
+                                and len(dev._dict_events) > 0 \
+                                and dev._ba_datacp != dev._ba_devdata:
+                            with dev._filelock:
                                 self.__check_change(dev)
 
+                        if fh is None:
+                            mm[dev._slc_outoff] = \
+                                dev._ba_devdata[dev._slc_out]
+                            continue
+
+                        # Nur schreiben, was vom gelesenen Abbild abweicht
+                        buff = dev._ba_devdata[dev._slc_out]
+                        if bytesbuff[dev._slc_outoff] == buff:
+                            continue
+                        if fd is not None:
+                            pwrite(fd, buff, dev._slc_outoff.start)
+                        else:
                             fh.seek(dev._slc_outoff.start)
-                            fh.write(dev._ba_devdata[dev._slc_out])
+                            fh.write(buff)
 
-                    if self._modio._buffedwrite:
+                    if buffedwrite:
                         fh.flush()
 
+            except ValueError:
+                if mm is None or not mm.closed:
+                    raise
+                # Prozessabbild wurde nach Ablauf von join() geschlossen
+                lck_release()
+                break
+
             except IOError as e:
-                self._modio._gotioerror("autorefresh", e, mrk_warn)
-                mrk_warn = self._modio._debug == -1
-                self.lck_refresh.release()
+                modio._gotioerror("autorefresh", e, mrk_warn)
+                mrk_warn = modio._debug == -1
+                lck_release()
                 continue
 
             else:
                 if not mrk_warn:
-                    if self._modio._debug == 0:
+                    if modio._debug == 0:
                         warnings.warn(
                             "recover from io errors on process image",
                             RuntimeWarning
@@ -576,37 +725,53 @@ class ProcimgWriter(Thread):
                         warnings.warn(
                             "recover from io errors on process image - total "
                             "count of {0} errors now"
-                            "".format(self._modio._ioerror),
+                            "".format(modio._ioerror),
                             RuntimeWarning
                         )
                 mrk_warn = True
 
                 # Alle aufwecken
-                self.lck_refresh.release()
-                self.newdata.set()
+                lck_release()
+                newdata_set()
 
             finally:
                 # Verzögerte Events prüfen
                 if self.__eventwork:
-                    for tup_fire in tuple(self.__dict_delay.keys()):
-                        if tup_fire[0].overwrite and \
-                                tup_fire[3].value != tup_fire[2]:
-                            del self.__dict_delay[tup_fire]
+                    self.__delay_tick += 1
+                    delay_heap = self.__delay_heap
+                    delay_pending = self.__delay_pending
+                    while delay_heap \
+                            and delay_heap[0][0] <= self.__delay_tick:
+                        fire_tick, seq, tup_fire, snapshot = \
+                            heappop(delay_heap)
+
+                        # Überholte Einträge von neu gestarteten Events
+                        if delay_pending.get(tup_fire) != seq:
+                            continue
+                        del delay_pending[tup_fire]
+
+                        # Bei overwrite nur mit unverändertem Wert auslösen
+                        if tup_fire[0].overwrite:
+                            io_fire = tup_fire[3]
+                            ba_devdata = io_fire._parentdevice._ba_devdata
+                            if io_fire._bitshift:
+                                if ba_devdata[io_fire._slc_address.start] \
+                                        & io_fire._bitshift != snapshot:
+                                    continue
+                            elif ba_devdata[io_fire._slc_address] != snapshot:
+                                continue
+
+                        # Verzögertes Event übernehmen
+                        if tup_fire[0].as_thread:
+                            self._eventqth.put(tup_fire, False)
                         else:
-                            self.__dict_delay[tup_fire] -= 1
-                            if self.__dict_delay[tup_fire] <= 0:
-                                # Verzögertes Event übernehmen und löschen
-                                if tup_fire[0].as_thread:
-                                    self._eventqth.put(tup_fire, False)
-                                else:
-                                    self._eventq.put(tup_fire, False)
-                                del self.__dict_delay[tup_fire]
+                            self._eventq.put(tup_fire, False)
 
                 # Refresh abwarten
-                self._work.wait(self._adjwait)
+                work_wait(self._adjwait)
 
             # Wartezeit anpassen um echte self._refresh zu erreichen
-            mrk_dt = default_timer()
+            mrk_dt = timer()
             if mrk_dt - ot >= self._refresh:
                 self._adjwait -= 0.001
                 if self._adjwait < 0:
@@ -622,7 +787,8 @@ class ProcimgWriter(Thread):
         # Alle am Ende erneut aufwecken
         self._collect_events(False)
         self.newdata.set()
-        fh.close()
+        if fh is not None:
+            fh.close()
 
     def stop(self):
         """Beendet die automatische Prozessabbildsynchronisierung."""
@@ -21,10 +21,13 @@ except Exception:
 class IOEvent(object):
     """Basisklasse fuer IO-Events."""
 
-    __slots__ = "as_thread", "delay", "edge", "func", "overwrite", "prefire"
+    __slots__ = "_edgemask", "as_thread", "delay", "edge", "func", \
+                "overwrite", "prefire"
 
     def __init__(self, func, edge, as_thread, delay, overwrite, prefire):
         """Init IOEvent class."""
+        # Bit 2 für steigende und Bit 1 für fallende Flanke
+        self._edgemask = 3 if edge == BOTH else 2 if edge == RISING else 1
         self.as_thread = as_thread
         self.delay = delay
         self.edge = edge
@@ -51,7 +54,8 @@ class IOList(object):
         if type(key) == int:
             return len(self.__dict_iobyte.get(key, [])) > 0
         else:
-            return hasattr(self, key) and type(getattr(self, key)) != DeadIO
+            # Ersetzte IOs (DeadIO) liegen nicht im Instanz-dict
+            return key in self.__dict__
 
     def __delattr__(self, key):
         """
@@ -114,6 +118,8 @@ class IOList(object):
                     key.start, key.stop, 1 if key.step is None else key.step
                 )
             ]
+        elif key in self.__dict__:
+            return self.__dict__[key]
         else:
             return getattr(self, key)
 
@@ -461,6 +467,7 @@ class IOBase(object):
             with self._parentdevice._filelock:
                 self._parentdevice._dict_events[self] = \
                     [IOEvent(func, edge, as_thread, delay, overwrite, prefire)]
+                self._parentdevice._update_event_table()
         else:
             # Prüfen ob Funktion schon registriert ist
             for regfunc in self._parentdevice._dict_events[self]:
@@ -497,6 +504,7 @@ class IOBase(object):
                 self._parentdevice._dict_events[self].append(
                     IOEvent(func, edge, as_thread, delay, overwrite, prefire)
                 )
+                self._parentdevice._update_event_table()
 
     def _get_address(self) -> int:
         """
@@ -719,6 +727,7 @@ class IOBase(object):
             if func is None:
                 with self._parentdevice._filelock:
                     del self._parentdevice._dict_events[self]
+                    self._parentdevice._update_event_table()
             else:
                 newlist = []
                 for regfunc in self._parentdevice._dict_events[self]:
@@ -732,6 +741,7 @@ class IOBase(object):
                         self._parentdevice._dict_events[self] = newlist
                     else:
                         del self._parentdevice._dict_events[self]
+                    self._parentdevice._update_event_table()
 
     def wait(self, edge=BOTH, exitevent=None, okvalue=None, timeout=0) -> int:
         """
@@ -2,17 +2,22 @@
 """RevPiModIO Hauptklasse fuer piControl0 Zugriff."""
 import warnings
 from configparser import ConfigParser
+from copy import deepcopy
+from io import FileIO
 from json import load as jload
+from mmap import mmap
 from multiprocessing import cpu_count
-from os import F_OK, R_OK, access
+from os import F_OK, R_OK, access, fstat
 from os import stat as osstat
+from os.path import abspath
 from queue import Empty
 from signal import SIGINT, SIGTERM, SIG_DFL, signal
-from stat import S_ISCHR
+from stat import S_ISCHR, S_ISREG
 from threading import Event, Lock, Thread
 from timeit import default_timer
 
-from revpimodio2 import BOTH, DeviceNotFoundError, FALLING, RISING, acheck
+from revpimodio2 import DeviceNotFoundError, acheck
+from .helper import preadv, pwrite
 
 __author__ = "Sven Sager"
 __copyright__ = "Copyright (C) 2020 Sven Sager"
@@ -37,8 +42,12 @@ class RevPiModIO(object):
                 "_maxioerrors", "_myfh", "_myfh_lck", "_monitoring", "_procimg", \
                 "_simulator", "_syncoutputs", "_th_mainloop", "_waitexit", \
                 "core", "app", "device", "exitsignal", "io", "summary", "_debug", \
+                "_fd", "_mm", "_readbuf", "_readbuf_lck", "_refresh_gen", \
                 "_replace_io_file", "_run_on_pi"
 
+    # Geparste piCtory Konfigurationen je absolutem Pfad mit Dateikennung
+    _CONFIG_CACHE = {}
+
     def __init__(
             self, autorefresh=False, monitoring=False, syncoutputs=True,
             procimg=None, configrsc=None, simulator=False, debug=True,
@@ -96,9 +105,14 @@ class RevPiModIO(object):
         self._looprunning = False
         self._lst_devselect = []
         self._lst_refresh = []
+        self._refresh_gen = 0
         self._maxioerrors = 0
+        self._fd = None
+        self._mm = None
         self._myfh = None
         self._myfh_lck = Lock()
+        self._readbuf = memoryview(bytearray())
+        self._readbuf_lck = Lock()
         self._replace_io_file = replace_io_file
         self._th_mainloop = None
         self._waitexit = Event()
@@ -132,7 +146,10 @@ class RevPiModIO(object):
         """Zerstoert alle Klassen um aufzuraeumen."""
         if hasattr(self, "_exit"):
             self.exit(full=True)
+            if self._mm is not None:
+                self._mm.close()
             if self._myfh is not None:
+                self._fd = None
                 self._myfh.close()
 
     def __evt_exit(self, signum, sigframe) -> None:
@@ -161,6 +178,7 @@ class RevPiModIO(object):
             # Alle Devices aus Autorefresh entfernen
             while len(self._lst_refresh) > 0:
                 dev = self._lst_refresh.pop()
+                self._refresh_gen += 1
                 dev._selfupdate = False
                 if not self._monitoring:
                     self.writeprocimg(dev)
@@ -172,8 +190,13 @@ class RevPiModIO(object):
             self.__cleanupfunc()
             if not self._monitoring:
                 self.writeprocimg()
+                self._flush_mm()
 
         if self._exit_level & 2:
+            if self._mm is not None:
+                self._flush_mm()
+                self._mm.close()
+            self._fd = None
             self._myfh.close()
             self.app = None
             self.core = None
@@ -223,9 +246,28 @@ class RevPiModIO(object):
         self.device = devicemodule.DeviceList()
         self.io = IOList()
 
+        # Devices nach Positionsnummer in Fächer einsortieren
+        lst_bucket = []
+        for device in lst_devices:
+            position = device["position"]
+            if type(position) != int or position < 0:
+                # Andere Positionen wie "adap." wie bisher sortieren
+                lst_bucket = None
+                break
+            while len(lst_bucket) <= position:
+                lst_bucket.append([])
+            lst_bucket[position].append(device)
+
+        if lst_bucket is None:
+            lst_devices = sorted(lst_devices, key=lambda x: x["position"])
+        else:
+            lst_devices = [
+                device for bucket in lst_bucket for device in bucket
+            ]
+
         # Devices initialisieren
         err_names = []
-        for device in sorted(lst_devices, key=lambda x: x["position"]):
+        for device in lst_devices:
 
             # VDev alter piCtory Versionen auf Kunbus-Standard ändern
             if device["position"] == "adap.":
@@ -318,6 +360,16 @@ class RevPiModIO(object):
                 Warning
             )
 
+        # Prozessabbild mappen, sobald die Länge bekannt ist
+        if self._mm is None:
+            self._mm = self._create_mm()
+        if self._mm is None:
+            # Wiederverwendbarer Lesepuffer für Zugriff über das FileObject
+            self._readbuf = memoryview(bytearray(self._length))
+            if preadv is not None and isinstance(self._myfh, FileIO):
+                # Direkter Zugriff über den Dateideskriptor ohne seek()
+                self._fd = self._myfh.fileno()
+
         # ImgWriter erstellen
         self._imgwriter = helpermodule.ProcimgWriter(self)
 
@@ -422,6 +474,30 @@ class RevPiModIO(object):
                         "| RevPiModIO message: {2}".format(parentio, io, e)
                     )
 
+    def _create_mm(self):
+        """
+        Erstellt ein mmap Objekt ueber das Prozessabbild.
+
+        Lesen und Schreiben erfolgt dann als Slice-Kopie ohne Systemaufrufe.
+        Kann das Prozessabbild nicht gemappt werden (z.B. Treiber ohne mmap
+        Unterstuetzung oder zu kleine Simulatordatei), wird weiterhin ueber
+        das FileObject gearbeitet.
+
+        :return: <class 'mmap'> oder None, wenn nicht mapbar
+        """
+        if self._length == 0:
+            return None
+
+        try:
+            with open(self._procimg, "r+b", 0) as fh:
+                st = fstat(fh.fileno())
+                if S_ISREG(st.st_mode) and st.st_size < self._length:
+                    # Zugriff hinter Dateiende würde SIGBUS auslösen
+                    return None
+                return mmap(fh.fileno(), self._length)
+        except (OSError, ValueError):
+            return None
+
     def _create_myfh(self):
         """
         Erstellt FileObject mit Pfad zum procimg.
@@ -431,6 +507,16 @@ class RevPiModIO(object):
         self._buffedwrite = False
         return open(self._procimg, "r+b", 0)
 
+    def _flush_mm(self) -> None:
+        """Schreibt das gemappte Prozessabbild mit einem msync zurueck."""
+        if self._mm is None or self._mm.closed:
+            return
+        try:
+            self._mm.flush()
+        except OSError:
+            # Gerätedateien unterstützen nicht immer msync
+            pass
+
     def _get_configrsc(self) -> str:
         """
         Getter function.
@@ -483,6 +569,59 @@ class RevPiModIO(object):
         """
         return self._ioerror
 
+    def _get_jconfigrsc(self) -> dict:
+        """
+        Laedt die piCtory Konfiguration mit Zwischenspeicher.
+
+        Die Konfiguration wird nur neu gelesen, wenn sich die Datei geaendert
+        hat. Das <class 'dict'> wird von allen Instanzen geteilt und darf
+        nicht veraendert werden.
+
+        :return: <class 'dict'> der piCtory Konfiguration
+        """
+        # piCtory Konfiguration prüfen
+        if self._configrsc is not None:
+            if not access(self._configrsc, F_OK | R_OK):
+                raise RuntimeError(
+                    "can not access pictory configuration at {0}".format(
+                        self._configrsc))
+        else:
+            # piCtory Konfiguration an bekannten Stellen prüfen
+            lst_rsc = ["/etc/revpi/config.rsc", "/opt/KUNBUS/config.rsc"]
+            for rscfile in lst_rsc:
+                if access(rscfile, F_OK | R_OK):
+                    self._configrsc = rscfile
+                    break
+            if self._configrsc is None:
+                raise RuntimeError(
+                    "can not access known pictory configurations at {0} - "
+                    "use 'configrsc' parameter so specify location"
+                    "".format(", ".join(lst_rsc))
+                )
+
+        # Zwischengespeicherte Konfiguration verwenden, wenn Datei unverändert
+        path = abspath(self._configrsc)
+        st = osstat(path)
+        tup_file = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        tup_cache = RevPiModIO._CONFIG_CACHE.get(path)
+        if tup_cache is not None and tup_cache[0] == tup_file:
+            return tup_cache[1]
+
+        with open(path, "r") as fhconfigrsc:
+            # Kennung der tatsächlich gelesenen Datei speichern
+            st = fstat(fhconfigrsc.fileno())
+            tup_file = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+            try:
+                jdata = jload(fhconfigrsc)
+            except Exception:
+                raise RuntimeError(
+                    "can not read piCtory configuration - check your hardware "
+                    "configuration http://revpi_ip/"
+                )
+
+        RevPiModIO._CONFIG_CACHE[path] = (tup_file, jdata)
+        return jdata
+
     def _get_length(self) -> int:
         """
         Getter function.
@@ -737,31 +876,41 @@ class RevPiModIO(object):
         cycleinfo = helpermodule.Cycletools(self._imgwriter.refresh, self)
         e = None  # Exception
         ec = None  # Return value of cycle_function
+
+        # Für die Schleife lokal binden
+        imgwriter = self._imgwriter
+        newdata_wait = imgwriter.newdata.wait
+        newdata_clear = imgwriter.newdata.clear
+        lck_acquire = imgwriter.lck_refresh.acquire
+        lck_release = imgwriter.lck_refresh.release
+        exit_is_set = self._exit.is_set
+        docycle = cycleinfo._docycle
+        timer = default_timer
         try:
             while ec is None and not cycleinfo.last:
                 # Auf neue Daten warten und nur ausführen wenn set()
-                if not self._imgwriter.newdata.wait(2.5):
+                if not newdata_wait(2.5):
                     self.exit(full=False)
-                    if self._imgwriter.is_alive():
+                    if imgwriter.is_alive():
                         e = RuntimeError("no new io data in cycle loop")
                     else:
                         e = RuntimeError("autorefresh thread not running")
                     break
-                self._imgwriter.newdata.clear()
+                newdata_clear()
 
                 # Vor Aufruf der Funktion autorefresh sperren
-                self._imgwriter.lck_refresh.acquire()
+                lck_acquire()
 
                 # Vorbereitung für cycleinfo
-                cycleinfo._start_timer = default_timer()
-                cycleinfo.last = self._exit.is_set()
+                cycleinfo._start_timer = timer()
+                cycleinfo.last = exit_is_set()
 
                 # Funktion aufrufen und auswerten
                 ec = func(cycleinfo)
-                cycleinfo._docycle()
+                docycle()
 
                 # autorefresh freigeben
-                self._imgwriter.lck_refresh.release()
+                lck_release()
         except Exception as ex:
             if self._imgwriter.lck_refresh.locked():
                 self._imgwriter.lck_refresh.release()
@@ -861,35 +1010,7 @@ class RevPiModIO(object):
 
         :return: <class 'dict'> der piCtory Konfiguration
         """
-        # piCtory Konfiguration prüfen
-        if self._configrsc is not None:
-            if not access(self._configrsc, F_OK | R_OK):
-                raise RuntimeError(
-                    "can not access pictory configuration at {0}".format(
-                        self._configrsc))
-        else:
-            # piCtory Konfiguration an bekannten Stellen prüfen
-            lst_rsc = ["/etc/revpi/config.rsc", "/opt/KUNBUS/config.rsc"]
-            for rscfile in lst_rsc:
-                if access(rscfile, F_OK | R_OK):
-                    self._configrsc = rscfile
-                    break
-            if self._configrsc is None:
-                raise RuntimeError(
-                    "can not access known pictory configurations at {0} - "
-                    "use 'configrsc' parameter so specify location"
-                    "".format(", ".join(lst_rsc))
-                )
-
-        with open(self._configrsc, "r") as fhconfigrsc:
-            try:
-                jdata = jload(fhconfigrsc)
-            except Exception:
-                raise RuntimeError(
-                    "can not read piCtory configuration - check your hardware "
-                    "configuration http://revpi_ip/"
-                )
-            return jdata
+        return deepcopy(self._get_jconfigrsc())
 
     def handlesignalend(self, cleanupfunc=None) -> None:
         """
@@ -971,7 +1092,7 @@ class RevPiModIO(object):
         # Beim Eintritt in mainloop Bytecopy erstellen und prefire anhängen
         for dev in self._lst_refresh:
             with dev._filelock:
-                dev._ba_datacp = dev._ba_devdata[:]
+                dev._ba_datacp[:] = dev._ba_devdata
 
                 # Prefire Events vorbereiten
                 for io in dev._dict_events:
@@ -979,9 +1100,7 @@ class RevPiModIO(object):
                         if not regfunc.prefire:
                             continue
 
-                        if regfunc.edge == BOTH \
-                                or regfunc.edge == RISING and io.value \
-                                or regfunc.edge == FALLING and not io.value:
+                        if regfunc._edgemask & (2 if io.value else 1):
                             if regfunc.as_thread:
                                 self._imgwriter._eventqth.put(
                                     (regfunc, io._name, io.value), False
@@ -996,25 +1115,32 @@ class RevPiModIO(object):
         e = None
         runtime = -1 if self._debug == -1 else 0
 
-        while not self._exit.is_set():
+        # Für die Schleife lokal binden
+        imgwriter = self._imgwriter
+        eventq_qsize = imgwriter._eventq.qsize
+        eventq_get = imgwriter._eventq.get
+        exit_is_set = self._exit.is_set
+        timer = default_timer
+
+        while not exit_is_set():
 
             # Laufzeit der Eventqueue auf 0 setzen
-            if self._imgwriter._eventq.qsize() == 0:
+            if eventq_qsize() == 0:
                 runtime = -1 if self._debug == -1 else 0
 
             try:
-                tup_fire = self._imgwriter._eventq.get(timeout=1)
+                tup_fire = eventq_get(timeout=1)
 
                 # Messung Laufzeit der Queue starten
                 if runtime == 0:
-                    runtime = default_timer()
+                    runtime = timer()
 
                 # Direct callen da Prüfung in io.IOBase.reg_event ist
                 tup_fire[0].func(tup_fire[1], tup_fire[2])
 
                 # Laufzeitprüfung
                 if runtime != -1 and \
-                        default_timer() - runtime > self._imgwriter._refresh:
+                        timer() - runtime > imgwriter._refresh:
                     runtime = -1
                     warnings.warn(
                         "can not execute all event functions in one cycle - "
@@ -1022,7 +1148,7 @@ class RevPiModIO(object):
                         RuntimeWarning
                     )
             except Empty:
-                if not self._exit.is_set() and not self._imgwriter.is_alive():
+                if not exit_is_set() and not imgwriter.is_alive():
                     e = RuntimeError("autorefresh thread not running")
                     break
             except Exception as ex:
@@ -1065,31 +1191,51 @@ class RevPiModIO(object):
                 )
             mylist = [dev]
 
-        # Daten komplett einlesen
-        self._myfh_lck.acquire()
+        if self._mm is None:
+            # Lesepuffer bis zum Ende der Kopie sperren
+            self._readbuf_lck.acquire()
+            bytesbuff = self._readbuf
+        else:
+            # Gemapptes Prozessabbild direkt verwenden
+            bytesbuff = self._mm
+
         try:
-            self._myfh.seek(0)
-            bytesbuff = self._myfh.read(self._length)
-        except IOError as e:
-            self._gotioerror("readprocimg", e)
-            return False
-        finally:
-            self._myfh_lck.release()
+            if self._fd is not None:
+                # Daten komplett einlesen
+                try:
+                    preadv(self._fd, [bytesbuff], 0)
+                except IOError as e:
+                    self._gotioerror("readprocimg", e)
+                    return False
+            elif self._mm is None:
+                self._myfh_lck.acquire()
+                try:
+                    self._myfh.seek(0)
+                    self._myfh.readinto(bytesbuff)
+                except IOError as e:
+                    self._gotioerror("readprocimg", e)
+                    return False
+                finally:
+                    self._myfh_lck.release()
 
-        for dev in mylist:
-            if not dev._selfupdate:
+            for dev in mylist:
+                if not dev._selfupdate:
 
-                # FileHandler sperren
-                dev._filelock.acquire()
+                    # FileHandler sperren
+                    dev._filelock.acquire()
 
-                if self._monitoring or self._direct_output:
-                    # Alles vom Bus einlesen
-                    dev._ba_devdata[:] = bytesbuff[dev._slc_devoff]
-                else:
-                    # Inputs vom Bus einlesen
-                    dev._ba_devdata[dev._slc_inp] = bytesbuff[dev._slc_inpoff]
+                    if self._monitoring or self._direct_output:
+                        # Alles vom Bus einlesen
+                        dev._ba_devdata[:] = bytesbuff[dev._slc_devoff]
+                    else:
+                        # Inputs vom Bus einlesen
+                        dev._ba_devdata[dev._slc_inp] = \
+                            bytesbuff[dev._slc_inpoff]
 
-                dev._filelock.release()
+                    dev._filelock.release()
+        finally:
+            if self._mm is None:
+                self._readbuf_lck.release()
 
         return True
 
@@ -1142,21 +1288,38 @@ class RevPiModIO(object):
                 )
             mylist = [dev]
 
-        self._myfh_lck.acquire()
+        if self._mm is None:
+            self._readbuf_lck.acquire()
+            bytesbuff = self._readbuf
+        else:
+            bytesbuff = self._mm
+
         try:
-            self._myfh.seek(0)
-            bytesbuff = self._myfh.read(self._length)
-        except IOError as e:
-            self._gotioerror("syncoutputs", e)
-            return False
-        finally:
-            self._myfh_lck.release()
+            if self._fd is not None:
+                try:
+                    preadv(self._fd, [bytesbuff], 0)
+                except IOError as e:
+                    self._gotioerror("syncoutputs", e)
+                    return False
+            elif self._mm is None:
+                self._myfh_lck.acquire()
+                try:
+                    self._myfh.seek(0)
+                    self._myfh.readinto(bytesbuff)
+                except IOError as e:
+                    self._gotioerror("syncoutputs", e)
+                    return False
+                finally:
+                    self._myfh_lck.release()
 
-        for dev in mylist:
-            if not dev._selfupdate:
-                dev._filelock.acquire()
-                dev._ba_devdata[dev._slc_out] = bytesbuff[dev._slc_outoff]
-                dev._filelock.release()
+            for dev in mylist:
+                if not dev._selfupdate:
+                    dev._filelock.acquire()
+                    dev._ba_devdata[dev._slc_out] = bytesbuff[dev._slc_outoff]
+                    dev._filelock.release()
+        finally:
+            if self._mm is None:
+                self._readbuf_lck.release()
 
         return True
 
@@ -1193,22 +1356,45 @@ class RevPiModIO(object):
 
         global_ex = None
         workokay = True
+        lst_write = []
         for dev in mylist:
-            if not dev._selfupdate:
-                dev._filelock.acquire()
+            if dev._selfupdate or dev._slc_out.start == dev._slc_out.stop:
+                continue
 
-                # Outpus auf Bus schreiben
-                self._myfh_lck.acquire()
+            dev._filelock.acquire()
+            buff = dev._ba_devdata[dev._slc_out]
+            dev._filelock.release()
+
+            if self._mm is not None:
+                # Outputs direkt in das gemappte Prozessabbild kopieren
+                self._mm[dev._slc_outoff] = buff
+            elif len(lst_write) > 0 and \
+                    lst_write[-1][0] + len(lst_write[-1][1]) \
+                    == dev._slc_outoff.start:
+                # Angrenzende Outputbereiche zu einem Schreibzugriff verbinden
+                lst_write[-1][1] += buff
+            else:
+                lst_write.append([dev._slc_outoff.start, buff])
+
+        # Outpus auf Bus schreiben
+        for offset, buff in lst_write:
+            if self._fd is not None:
                 try:
-                    self._myfh.seek(dev._slc_outoff.start)
-                    self._myfh.write(dev._ba_devdata[dev._slc_out])
+                    pwrite(self._fd, buff, offset)
                 except IOError as e:
                     global_ex = e
                     workokay = False
-                finally:
-                    self._myfh_lck.release()
+                continue
 
-                dev._filelock.release()
+            self._myfh_lck.acquire()
+            try:
+                self._myfh.seek(offset)
+                self._myfh.write(buff)
+            except IOError as e:
+                global_ex = e
+                workokay = False
+            finally:
+                self._myfh_lck.release()
 
         if self._buffedwrite:
             try:
@@ -1267,40 +1453,34 @@ class RevPiModIOSelected(RevPiModIO):
         )
 
         # Device liste erstellen
-        if type(deviceselection) == list:
-            for dev in deviceselection:
-                self._lst_devselect.append(dev)
+        if isinstance(deviceselection, list):
+            self._lst_devselect.extend(deviceselection)
         else:
             self._lst_devselect.append(deviceselection)
 
+        tup_types = (int, str)
         for vdev in self._lst_devselect:
-            if type(vdev) != int and type(vdev) != str:
+            # bool ist Unterklasse von int, aber keine Position
+            if not isinstance(vdev, tup_types) or isinstance(vdev, bool):
                 raise ValueError(
                     "need device position as <class 'int'> or device name as "
                     "<class 'str'>"
                 )
 
+        # Doppelte Angaben entfernen, Reihenfolge bleibt erhalten
+        self._lst_devselect[:] = list(dict.fromkeys(self._lst_devselect))
+
         self._configure(self.get_jconfigrsc())
         self._configure_replace_io(self._get_cpreplaceio())
 
-        if len(self.device) == 0:
-            if type(self) == RevPiModIODriver:
-                raise DeviceNotFoundError(
-                    "could not find any given VIRTUAL devices in config"
-                )
-            else:
-                raise DeviceNotFoundError(
-                    "could not find any given devices in config"
-                )
-        elif len(self.device) != len(self._lst_devselect):
-            if type(self) == RevPiModIODriver:
-                raise DeviceNotFoundError(
-                    "could not find all given VIRTUAL devices in config"
-                )
-            else:
-                raise DeviceNotFoundError(
-                    "could not find all given devices in config"
+        int_found = len(self.device)
+        if int_found == 0 or int_found != len(self._lst_devselect):
+            raise DeviceNotFoundError(
+                "could not find {0} given {1}devices in config".format(
+                    "any" if int_found == 0 else "all",
+                    "VIRTUAL " if isinstance(self, RevPiModIODriver) else ""
                 )
+            )
 
 
 class RevPiModIODriver(RevPiModIOSelected):
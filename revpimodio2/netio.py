@@ -861,6 +861,14 @@ class RevPiNetIO(_RevPiModIO):
             self._configure(self.get_jconfigrsc())
             self._configure_replace_io(self._get_cpreplaceio())
 
+    def _create_mm(self):
+        """
+        Prozessabbild ueber das Netzwerk kann nicht gemappt werden.
+
+        :return: None
+        """
+        return None
+
     def _create_myfh(self):
         """
         Erstellt NetworkFileObject.
@@ -1052,40 +1060,34 @@ class RevPiNetIOSelected(RevPiNetIO):
         )
 
         # Device liste erstellen
-        if type(deviceselection) == list:
-            for dev in deviceselection:
-                self._lst_devselect.append(dev)
+        if isinstance(deviceselection, list):
+            self._lst_devselect.extend(deviceselection)
         else:
             self._lst_devselect.append(deviceselection)
 
+        tup_types = (int, str)
         for vdev in self._lst_devselect:
-            if type(vdev) != int and type(vdev) != str:
+            # bool ist Unterklasse von int, aber keine Position
+            if not isinstance(vdev, tup_types) or isinstance(vdev, bool):
                 raise TypeError(
                     "need device position as <class 'int'> or device name as "
                     "<class 'str'>"
                 )
 
+        # Doppelte Angaben entfernen, Reihenfolge bleibt erhalten
+        self._lst_devselect[:] = list(dict.fromkeys(self._lst_devselect))
+
         self._configure(self.get_jconfigrsc())
         self._configure_replace_io(self._get_cpreplaceio())
 
-        if len(self.device) == 0:
-            if type(self) == RevPiNetIODriver:
-                raise DeviceNotFoundError(
-                    "could not find any given VIRTUAL devices in config"
-                )
-            else:
-                raise DeviceNotFoundError(
-                    "could not find any given devices in config"
-                )
-        elif len(self.device) != len(self._lst_devselect):
-            if type(self) == RevPiNetIODriver:
-                raise DeviceNotFoundError(
-                    "could not find all given VIRTUAL devices in config"
-                )
-            else:
-                raise DeviceNotFoundError(
-                    "could not find all given devices in config"
+        int_found = len(self.device)
+        if int_found == 0 or int_found != len(self._lst_devselect):
+            raise DeviceNotFoundError(
+                "could not find {0} given {1}devices in config".format(
+                    "any" if int_found == 0 else "all",
+                    "VIRTUAL " if isinstance(self, RevPiNetIODriver) else ""
                 )
+            )
 
 
 class RevPiNetIODriver(RevPiNetIOSelected):